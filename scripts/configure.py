@@ -1,12 +1,121 @@
 # scripts/configure.py
 #!/usr/bin/env python3
+import errno
+import hashlib
 import json
-# import os
-import tomllib
-# import tomli
+import os
+import time
 from pathlib import Path
 # import sys
 
+# 优先使用 Rust 实现的 rtoml，未安装时回退到标准库 tomllib
+try:
+    import rtoml
+    _toml_loads = rtoml.loads
+except ImportError:
+    import tomllib
+    _toml_loads = tomllib.loads
+
+# 优先使用 orjson 序列化输出的 JSON 配置，未安装时回退到标准库 json
+try:
+    import orjson
+
+    def _dump_json(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _dump_json(obj):
+        return json.dumps(obj, indent=2).encode()
+
+CACHE_DIR = Path("configs") / ".cache"
+
+# copy_file_range 不可用时回退到普通复制的错误码
+_COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+def load_toml_cached(toml_path, cache_dir=CACHE_DIR):
+    """加载 TOML 配置，使用 JSON 缓存避免重复解析
+
+    每个源文件对应一个缓存文件，缓存键（源文件路径、mtime 和大小）
+    保存在缓存内容中，源文件变化后自动失效并原地覆盖。
+    """
+    toml_path = Path(toml_path)
+    st = toml_path.stat()
+    key = f"{toml_path.resolve()}:{st.st_mtime_ns}:{st.st_size}"
+    # 以所在目录区分不同类别下的同名配置（如 arch/ 与 board/）
+    cache_file = Path(cache_dir) / f"{toml_path.parent.name}-{toml_path.stem}.json"
+
+    # 命中缓存
+    config = _read_cache(cache_file, key)
+    if config is not None:
+        return config
+
+    config = _toml_loads(toml_path.read_text(encoding="utf-8"))
+
+    _write_cache(cache_file, key, config)
+    return config
+
+def _read_cache(cache_file, key):
+    """读取 JSON 缓存，缓存键不匹配或缓存无效时返回 None"""
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
+    return cached.get("value")
+
+def _write_cache(cache_file, key, obj):
+    """原子写入 JSON 缓存（写临时文件后 rename）"""
+    try:
+        data = json.dumps({"key": key, "value": obj})
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(data)
+        os.replace(tmp_file, cache_file)
+    except (OSError, TypeError):
+        # 缓存失败（如只读目录、含日期类型）不影响配置加载
+        pass
+
+def write_if_changed(path, content):
+    """内容变化时才写入文件，返回是否写入
+
+    未变化的文件保持原 mtime，下游 make 可以跳过重新构建。
+    """
+    path = Path(path)
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(data)
+    return True
+
+def _fast_copy(src, dst):
+    """复制文件并保留元数据，Linux 上使用 copy_file_range 在内核中完成复制
+
+    不支持时（跨文件系统、旧内核、非 Linux）回退到 shutil.copyfile。
+    """
+    import shutil
+
+    copied_in_kernel = False
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            copied_in_kernel = remaining == 0
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+    if not copied_in_kernel:
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
 def load_board_config(board_name, config_dir="configs"):
     """加载开发板 TOML 配置"""
     board_file = Path(config_dir) / "board" / f"{board_name}.toml"
@@ -14,10 +123,63 @@ def load_board_config(board_name, config_dir="configs"):
     if not board_file.exists():
         raise FileNotFoundError(f"Board config not found: {board_file}")
     
-    with open(board_file, 'rb') as f:
-        config = tomllib.load(f)
+    return load_toml_cached(board_file, Path(config_dir) / ".cache")
+
+def load_merged_config(arch, board, profile, config_dir="configs"):
+    """加载并合并架构、开发板、构建配置
+
+    合并结果按 (arch, board, profile) 及三个 TOML 文件的内容缓存，
+    命中时跳过全部加载与合并；metadata 中的 timestamp 由调用方填写。
+    """
+    config_dir = Path(config_dir)
+    arch_file = config_dir / "arch" / f"{arch}.toml"
+    board_file = config_dir / "board" / f"{board}.toml"
+    profile_file = config_dir / "profile" / f"{profile}.toml"
+
+    # 计算缓存键：参数 + 各配置文件内容（文件不存在与空文件区分开）
+    key = hashlib.blake2b(digest_size=16)
+    for part in (arch, board, profile):
+        key.update(part.encode() + b"\x00")
+    for path in (arch_file, board_file, profile_file):
+        try:
+            data = path.read_bytes()
+            key.update(b"%d:" % len(data) + data)
+        except FileNotFoundError:
+            key.update(b"missing:")
+    key = key.hexdigest()
+    cache_file = config_dir / ".cache" / f"merged-{arch}-{board}-{profile}.json"
+
+    merged_config = _read_cache(cache_file, key)
+    if merged_config is not None:
+        return merged_config
+
+    # 1. 加载架构配置
+    arch_config = {}
+    if arch_file.exists():
+        arch_config = load_toml_cached(arch_file, config_dir / ".cache")
+    
+    # 2. 加载开发板配置
+    board_config = load_board_config(board, config_dir)
     
-    return config
+    # 3. 加载构建配置
+    profile_config = {}
+    if profile_file.exists():
+        profile_config = load_toml_cached(profile_file, config_dir / ".cache")
+    
+    # 4. 合并配置
+    merged_config = {
+        "arch": arch_config,
+        "board": board_config,
+        "profile": profile_config,
+        "metadata": {
+            "arch": arch,
+            "board": board,
+            "profile": profile,
+        }
+    }
+
+    _write_cache(cache_file, key, merged_config)
+    return merged_config
 
 def process_dtb_config(board_config, board_name, output_dir):
     """处理 DTB 配置：复制 DTB 文件到输出目录"""
@@ -47,8 +209,7 @@ def process_dtb_config(board_config, board_name, output_dir):
         if source_dtb.exists():
             # 复制到输出目录
             dest_dtb = output_dir / filename
-            import shutil
-            shutil.copy2(source_dtb, dest_dtb)
+            _fast_copy(source_dtb, dest_dtb)
             dtb_path = dest_dtb
             print(f"  DTB file: {filename} (copied from {source_dtb})")
         elif required:
@@ -58,20 +219,24 @@ def process_dtb_config(board_config, board_name, output_dir):
 
     return dtb_path
 
+# QEMU 运行配置默认值（按架构）
+QEMU_DEFAULTS = {
+    "default": {
+        "machine": "virt",
+        "cpu": "cortex-a72",
+        "devices": (),  # 不可变，避免经浅合并在各次配置间共享
+        "memory": "512M",
+        "kernel_args": "",
+        "description": "",
+    },
+}
+QEMU_DEFAULTS["x86_64"] = QEMU_DEFAULTS["default"] | {"cpu": "qemu64"}
+
 def generate_qemu_config(board_config, arch, output_dir, board_name):
     """从 board 配置生成 QEMU 运行配置"""
-    qemu_config = {
-        "machine": board_config.get("machine", "virt"),
-        "cpu": board_config.get("cpu", "cortex-a72"),
-        "devices": board_config.get("devices", []),
-        "memory": board_config.get("memory", "512M"),
-        "kernel_args": board_config.get("kernel_args", ""),
-        "description": board_config.get("description", ""),
-    }
-
-    # 根据架构调整
-    if arch == "x86_64":
-        qemu_config["cpu"] = board_config.get("cpu", "qemu64")
+    # 架构默认值，board 配置中出现的键覆盖默认值
+    defaults = QEMU_DEFAULTS.get(arch, QEMU_DEFAULTS["default"])
+    qemu_config = defaults | {k: v for k, v in board_config.items() if k in defaults}
 
     # 处理 DTB 配置
     dtb_path = process_dtb_config(board_config, board_name, output_dir)
@@ -81,8 +246,7 @@ def generate_qemu_config(board_config, arch, output_dir, board_name):
 
     # 保存为 JSON（供 Python 脚本使用）
     config_file = Path(output_dir) / "qemu_config.json"
-    with open(config_file, 'w') as f:
-        json.dump(qemu_config, f, indent=2)
+    write_if_changed(config_file, _dump_json(qemu_config))
 
     return qemu_config
 
@@ -108,35 +272,10 @@ def main():
     print(f"  Profile: {args.profile}")
     print(f"  Output: {output_dir}")
     
-    # 1. 加载架构配置
-    arch_config = {}
-    arch_file = Path("configs/arch") / f"{args.arch}.toml"
-    if arch_file.exists():
-        with open(arch_file, 'rb') as f:
-            arch_config = tomllib.load(f)
-    
-    # 2. 加载开发板配置
-    board_config = load_board_config(args.board)
-    
-    # 3. 加载构建配置
-    profile_config = {}
-    profile_file = Path("configs/profile") / f"{args.profile}.toml"
-    if profile_file.exists():
-        with open(profile_file, 'rb') as f:
-            profile_config = tomllib.load(f)
-    
-    # 4. 合并配置
-    merged_config = {
-        "arch": arch_config,
-        "board": board_config,
-        "profile": profile_config,
-        "metadata": {
-            "arch": args.arch,
-            "board": args.board,
-            "profile": args.profile,
-            "timestamp": time.time()
-        }
-    }
+    # 1-4. 加载并合并配置（输入未变化时直接使用缓存的合并结果）
+    merged_config = load_merged_config(args.arch, args.board, args.profile)
+    merged_config["metadata"]["timestamp"] = time.time()
+    board_config = merged_config["board"]
     
     # 5. 生成 QEMU 运行配置
     qemu_config = generate_qemu_config(board_config, args.arch, output_dir, args.board)
@@ -144,35 +283,40 @@ def main():
     
     # 6. 保存完整配置
     config_file = output_dir / "config.json"
-    with open(config_file, 'w') as f:
-        json.dump(merged_config, f, indent=2)
+    write_if_changed(config_file, _dump_json(merged_config))
     
     # 7. 生成环境文件
     env_file = output_dir / "env.sh"
-    with open(env_file, 'w') as f:
-        f.write(f"export ARCH={args.arch}\n")
-        f.write(f"export BOARD={args.board}\n")
-        f.write(f"export PROFILE={args.profile}\n")
-        f.write(f"export KERNEL_TARGET={args.arch}-unknown-none\n")
-        f.write(f"export SPACE_TARGET={args.arch}-unknown-hnx\n")
-        f.write(f"export QEMU_MACHINE={qemu_config['machine']}\n")
-        f.write(f"export QEMU_CPU={qemu_config['cpu']}\n")
-        if 'dtb' in qemu_config:
-            f.write(f"export QEMU_DTB={qemu_config['dtb']}\n")
-            f.write(f"export QEMU_DTB_FILENAME={qemu_config['dtb_filename']}\n")
+    env_dtb = ""
+    if 'dtb' in qemu_config:
+        env_dtb = (f"export QEMU_DTB={qemu_config['dtb']}\n"
+                   f"export QEMU_DTB_FILENAME={qemu_config['dtb_filename']}\n")
+    env_content = f"""\
+export ARCH={args.arch}
+export BOARD={args.board}
+export PROFILE={args.profile}
+export KERNEL_TARGET={args.arch}-unknown-none
+export SPACE_TARGET={args.arch}-unknown-hnx
+export QEMU_MACHINE={qemu_config['machine']}
+export QEMU_CPU={qemu_config['cpu']}
+{env_dtb}"""
+    write_if_changed(env_file, env_content)
     
     # 8. 生成 Makefile 片段
     makefile_fragment = output_dir / "Makefile.inc"
-    with open(makefile_fragment, 'w') as f:
-        f.write(f"# Auto-generated Makefile variables\n")
-        f.write(f"QEMU_MACHINE := {qemu_config['machine']}\n")
-        f.write(f"QEMU_CPU := {qemu_config['cpu']}\n")
-        f.write(f"QEMU_MEMORY := {qemu_config['memory']}\n")
-        if qemu_config['kernel_args']:
-            f.write(f"QEMU_KERNEL_ARGS := {qemu_config['kernel_args']}\n")
-        if 'dtb' in qemu_config:
-            f.write(f"QEMU_DTB := {qemu_config['dtb']}\n")
-            f.write(f"QEMU_DTB_FILENAME := {qemu_config['dtb_filename']}\n")
+    make_optional = ""
+    if qemu_config['kernel_args']:
+        make_optional += f"QEMU_KERNEL_ARGS := {qemu_config['kernel_args']}\n"
+    if 'dtb' in qemu_config:
+        make_optional += (f"QEMU_DTB := {qemu_config['dtb']}\n"
+                          f"QEMU_DTB_FILENAME := {qemu_config['dtb_filename']}\n")
+    make_content = f"""\
+# Auto-generated Makefile variables
+QEMU_MACHINE := {qemu_config['machine']}
+QEMU_CPU := {qemu_config['cpu']}
+QEMU_MEMORY := {qemu_config['memory']}
+{make_optional}"""
+    write_if_changed(makefile_fragment, make_content)
     
     print(f"\nConfiguration files generated:")
     print(f"  {config_file}")
@@ -190,5 +334,4 @@ def main():
         print(f"  Description: {qemu_config['description']}")
 
 if __name__ == "__main__":
-    import time
     main()
\ No newline at end of file
@@ -5,16 +5,156 @@ HNX 系统镜像创建工具
 """
 
 import argparse
-import subprocess
+import errno
+import gzip
+import hashlib
 import os
+import stat
 import sys
 import time
 import shutil
-import tempfile
 from pathlib import Path
 import json
 import struct
 
+# 优先使用 ISA-L 加速的多线程 gzip（python-isal），未安装时回退到标准库 gzip
+try:
+    from isal import igzip_threaded
+
+    def _gzip_open(path):
+        # ISA-L 的压缩级别范围为 0-3，3 与 gzip -6 的压缩率相当
+        return igzip_threaded.open(path, "wb", compresslevel=3, threads=os.cpu_count() or 1)
+except ImportError:
+    def _gzip_open(path):
+        return gzip.open(path, "wb", compresslevel=6)
+
+# cpio newc 格式常量
+NEWC_MAGIC = b"070701"
+NEWC_TRAILER = "TRAILER!!!"
+
+# 引导头格式：魔数 + 内核大小 + initrd偏移 + 命令行长度 + 命令行
+BOOT_HEADER = struct.Struct("<8sIII256s")
+
+# initrd /dev 下的字符设备节点：(名称, 主设备号, 次设备号)
+DEVICE_NODES = [
+    ("console", 5, 1),
+    ("null", 1, 3),
+    ("zero", 1, 5),
+    ("random", 1, 8),
+    ("urandom", 1, 9),
+]
+
+def _write_newc_entry(out, name, ino, st, data=b"", mode=None):
+    """写入一个 cpio newc 条目（110 字节头 + 文件名 + 数据，均按 4 字节对齐）
+
+    mode 非 None 时覆盖 st 中的文件模式。
+    """
+    if st is None:
+        nlink = mtime = rdev_major = rdev_minor = 0
+        mode = mode or 0
+    else:
+        mode = st.st_mode if mode is None else mode
+        nlink = st.st_nlink if stat.S_ISDIR(st.st_mode) else 1
+        mtime = int(st.st_mtime)
+        rdev_major = os.major(st.st_rdev)
+        rdev_minor = os.minor(st.st_rdev)
+    encoded_name = name.encode() + b"\x00"
+    fields = (ino, mode, 0, 0, nlink, mtime, len(data),
+              0, 0, rdev_major, rdev_minor, len(encoded_name), 0)
+    header = NEWC_MAGIC + b"".join(b"%08X" % field for field in fields)
+    out.write(header)
+    out.write(encoded_name)
+    out.write(b"\x00" * (-(len(header) + len(encoded_name)) % 4))
+    if data:
+        out.write(data)
+        out.write(b"\x00" * (-len(data) % 4))
+
+# 核心服务列表（新架构：init -> loader + ipcrouter）
+CORE_SERVICES = ["loader-service", "ipcrouter-service"]
+
+# 在 space 目录中查找可执行文件的子目录
+EXECUTABLE_SUBDIRS = ["", "bin", "sbin", "usr/bin"]
+
+def _iter_executables(root):
+    """遍历 root 及其 bin/sbin/usr/bin 子目录，产出可执行普通文件的 DirEntry
+
+    每个条目只做一次 stat，由 st_mode 同时判断文件类型和可执行位。
+    """
+    for subdir in EXECUTABLE_SUBDIRS:
+        try:
+            with os.scandir(Path(root) / subdir) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode) and st.st_mode & 0o111:
+                        yield entry
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+# 无法创建硬链接时回退到复制的错误码
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP}
+
+def _stage(src, dst):
+    """将 src 放入 dst：优先使用硬链接，无法链接时回退到复制
+
+    文件权限不在这里修改（硬链接会连带修改构建产物），
+    可执行位由 cpio 打包时写入归档头。
+    """
+    dst = Path(dst)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _LINK_FALLBACK_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+
+def _try_stat(path):
+    """stat 路径，不存在或无法访问时返回 None"""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def _is_regular_file(path):
+    """用一次 stat 判断路径是否为普通文件"""
+    st = _try_stat(path)
+    return st is not None and stat.S_ISREG(st.st_mode)
+
+def _file_digest(path):
+    """计算文件内容的 SHA-256 摘要"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def _copy_stream(src_file, dst_file, size):
+    """将 src_file 的 size 字节写入 dst_file 当前位置
+
+    Linux 上使用 sendfile 在内核中直接拷贝，其他平台回退到 1 MiB 缓冲区拷贝
+    （macOS 的 sendfile 只能写入 socket）。
+    """
+    offset = 0
+    if sys.platform.startswith("linux") and hasattr(os, "sendfile"):
+        # sendfile 直接写入 fd 当前位置，先刷出缓冲区中尚未写入的数据
+        dst_file.flush()
+        while offset < size:
+            try:
+                sent = os.sendfile(dst_file.fileno(), src_file.fileno(), offset, size - offset)
+            except OSError:
+                # 首次调用即不支持时（如特殊文件系统）回退到缓冲区拷贝
+                if offset:
+                    raise
+                break
+            if sent == 0:
+                break
+            offset += sent
+        if offset == size:
+            return
+    src_file.seek(offset)
+    shutil.copyfileobj(src_file, dst_file, 1 << 20)
+
 class ImageBuilder:
     """系统镜像构建器"""
     
@@ -50,37 +190,51 @@ class ImageBuilder:
         # 创建输出目录
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 临时目录
-        self.temp_dir = Path(tempfile.mkdtemp(prefix="hnx_image_"))
-        print(f"Using temporary directory: {self.temp_dir}")
-    
-    def __del__(self):
-        """清理临时目录"""
-        if hasattr(self, 'temp_dir') and self.temp_dir.exists():
-            shutil.rmtree(self.temp_dir)
-            print(f"Cleaned up temporary directory: {self.temp_dir}")
+        # 临时目录（由 build() 在构建期间创建并负责清理）
+        self.temp_dir = None
+        
+        # 暂存阶段记录的 initrd 条目（路径 -> 内存中的文件内容或 None），
+        # 打包时直接遍历，无需再次扫描暂存目录
+        self._entries = {}
+        
+        # 已放入 initrd 的可执行文件，打包时在 cpio 头中设置 0755 权限
+        self._executables = set()
     
-    def create_initrd(self):
-        """创建 initrd（初始 RAM 磁盘）"""
+    def create_initrd(self, final_path=None):
+        """创建 initrd（初始 RAM 磁盘）
+        
+        Args:
+            final_path: initrd 的最终输出路径；为 None 时写入临时目录
+        """
         print("Creating initrd...")
+        self._entries.clear()
+        self._executables.clear()
         
         if self.simple_initrd:
-            return self._create_simple_initrd()
+            return self._create_simple_initrd(final_path)
         else:
-            return self._create_full_initrd()
+            return self._create_full_initrd(final_path)
+    
+    def _initrd_output_path(self, final_path):
+        """确定 cpio 归档的输出路径"""
+        if final_path is not None:
+            return Path(final_path)
+        if self.no_compress:
+            return self.temp_dir / "initrd.cpio"
+        return self.temp_dir / "initrd.cpio.gz"
     
-    def _create_simple_initrd(self):
+    def _create_simple_initrd(self, final_path=None):
         """创建简单的 initrd（包含 init 和核心服务）"""
         print("Creating simple initrd with core services...")
 
         # 创建 initrd 目录
         initrd_root = self.temp_dir / "initrd"
-        initrd_root.mkdir(parents=True, exist_ok=True)
+        self._make_dir(initrd_root)
         print(f"  Created initrd root directory, {initrd_root}")
 
         # 创建 bin 目录用于存放服务
         bin_dir = initrd_root / "bin"
-        bin_dir.mkdir(exist_ok=True)
+        self._make_dir(bin_dir)
 
         # 查找并复制 init 二进制文件
         init_found = self._copy_init_binary(initrd_root)
@@ -92,10 +246,7 @@ class ImageBuilder:
         self._copy_core_services(bin_dir)
 
         # 打包为 cpio 归档
-        if self.no_compress:
-            initrd_path = self.temp_dir / "initrd.cpio"
-        else:
-            initrd_path = self.temp_dir / "initrd.cpio.gz"
+        initrd_path = self._initrd_output_path(final_path)
 
         self._pack_cpio(initrd_root, initrd_path, compress=not self.no_compress)
         # build_dir = Path("build")
@@ -105,19 +256,19 @@ class ImageBuilder:
         print(f"Simple initrd created: {initrd_path}")
         return initrd_path
     
-    def _create_full_initrd(self):
+    def _create_full_initrd(self, final_path=None):
         """创建完整的 initrd（包含目录结构、设备节点等）"""
         print("Creating full initrd...")
         
         # 创建 initrd 目录结构
         initrd_root = self.temp_dir / "initrd"
-        initrd_root.mkdir(parents=True, exist_ok=True)
+        self._make_dir(initrd_root)
         print(f"  Created initrd root directory, {initrd_root}")
 
         # 创建标准目录结构
         dirs = ["bin", "sbin", "lib", "dev", "proc", "sys", "tmp", "root", "etc"]
         for dir_name in dirs:
-            (initrd_root / dir_name).mkdir(exist_ok=True)
+            self._make_dir(initrd_root / dir_name)
             print(f"  Created initrd directory, {initrd_root / dir_name}")
         
         # 查找并复制 init 二进制文件
@@ -135,10 +286,7 @@ class ImageBuilder:
         self._create_config_files(initrd_root)
         
         # 打包为 cpio 归档
-        if self.no_compress:
-            initrd_path = self.temp_dir / "initrd.cpio"
-        else:
-            initrd_path = self.temp_dir / "initrd.cpio.gz"
+        initrd_path = self._initrd_output_path(final_path)
         
         self._pack_cpio(initrd_root, initrd_path, compress=not self.no_compress)
         
@@ -161,7 +309,7 @@ class ImageBuilder:
         # 优先查找 release 版本
         for build_type in ["release", "debug"]:
             init_path = self.space_dir / build_type / "init"
-            if init_path.exists() and init_path.is_file():
+            if _is_regular_file(init_path):
                 init_binary = init_path
                 print(f"  Found init binary: {init_path} ({build_type})")
                 break
@@ -169,7 +317,7 @@ class ImageBuilder:
         # 如果没有找到，尝试直接在 space_dir 查找
         if not init_binary:
             init_path = self.space_dir / "init"
-            if init_path.exists() and init_path.is_file():
+            if _is_regular_file(init_path):
                 init_binary = init_path
                 print(f"  Found init binary: {init_path}")
         
@@ -180,8 +328,7 @@ class ImageBuilder:
         # 复制到 initrd 根目录
         dest_path = initrd_root / "init"
         try:
-            shutil.copy2(init_binary, dest_path)
-            dest_path.chmod(0o755)
+            self._stage_executable(init_binary, dest_path)
             size = dest_path.stat().st_size
             print(f"  Copied init binary: {size:,} bytes to {dest_path}")
             return True
@@ -189,20 +336,34 @@ class ImageBuilder:
             print(f"  Warning: Failed to copy init binary: {e}")
             return False
 
+    def _make_dir(self, path):
+        """在暂存目录中创建目录并记录为 initrd 条目"""
+        path.mkdir(parents=True, exist_ok=True)
+        self._entries[path] = None
+
+    def _write_file(self, path, content):
+        """在暂存目录中写入文本文件，并把内容保留在内存中供打包使用"""
+        data = content.encode()
+        path.write_bytes(data)
+        self._entries[path] = data
+
+    def _stage_executable(self, src, dest_path):
+        """放入可执行文件并记录，打包时确保可执行权限"""
+        _stage(src, dest_path)
+        self._entries[dest_path] = None
+        self._executables.add(dest_path)
+
     def _copy_core_services(self, bin_dir):
         """复制核心服务二进制文件到 initrd 的 bin 目录"""
         print("Looking for core service binaries...")
 
-        # 核心服务列表（新架构：init -> loader + ipcrouter）
-        core_services = ["loader-service", "ipcrouter-service"]
-
-        for service_name in core_services:
+        for service_name in CORE_SERVICES:
             service_binary = None
 
             # 在 release/debug 目录中查找
             for build_type in ["release", "debug"]:
                 service_path = self.space_dir / build_type / service_name
-                if service_path.exists() and service_path.is_file():
+                if _is_regular_file(service_path):
                     service_binary = service_path
                     print(f"  Found {service_name}: {service_path} ({build_type})")
                     break
@@ -210,7 +371,7 @@ class ImageBuilder:
             # 如果没有找到，尝试直接在 space_dir 查找
             if not service_binary:
                 service_path = self.space_dir / service_name
-                if service_path.exists() and service_path.is_file():
+                if _is_regular_file(service_path):
                     service_binary = service_path
                     print(f"  Found {service_name}: {service_path}")
 
@@ -221,8 +382,7 @@ class ImageBuilder:
             # 复制到 bin 目录
             dest_path = bin_dir / service_name
             try:
-                shutil.copy2(service_binary, dest_path)
-                dest_path.chmod(0o755)
+                self._stage_executable(service_binary, dest_path)
                 size = dest_path.stat().st_size
                 print(f"  Copied {service_name}: {size:,} bytes")
             except Exception as e:
@@ -233,11 +393,7 @@ class ImageBuilder:
         print("Copying user space programs...")
         
         # 查找可执行文件
-        executables = []
-        for pattern in ["*", "bin/*", "sbin/*", "usr/bin/*"]:
-            for path in self.space_dir.glob(pattern):
-                if path.is_file() and os.access(path, os.X_OK):
-                    executables.append(path)
+        executables = [Path(entry.path) for entry in _iter_executables(self.space_dir)]
         
         if not executables:
             print("Warning: No executables found in space directory")
@@ -252,9 +408,7 @@ class ImageBuilder:
                 dest_path = initrd_root / "init"
             
             try:
-                shutil.copy2(exe, dest_path)
-                # 确保可执行权限
-                dest_path.chmod(0o755)
+                self._stage_executable(exe, dest_path)
                 print(f"  Copied: {exe.name} -> {dest_path.relative_to(initrd_root)}")
             except Exception as e:
                 print(f"  Warning: Failed to copy {exe.name}: {e}")
@@ -262,43 +416,31 @@ class ImageBuilder:
     def _create_device_nodes(self, initrd_root):
         """创建设备节点"""
         dev_dir = initrd_root / "dev"
-        dev_dir.mkdir(exist_ok=True)
+        self._make_dir(dev_dir)
         
-        # 尝试创建设备节点
+        # 尝试创建设备节点（非 root 时通常因权限不足失败）
         try:
-            # console
-            subprocess.run(["mknod", str(dev_dir / "console"), "c", "5", "1"], 
-                         capture_output=True)
-            # null
-            subprocess.run(["mknod", str(dev_dir / "null"), "c", "1", "3"], 
-                         capture_output=True)
-            # zero
-            subprocess.run(["mknod", str(dev_dir / "zero"), "c", "1", "5"], 
-                         capture_output=True)
-            # random
-            subprocess.run(["mknod", str(dev_dir / "random"), "c", "1", "8"], 
-                         capture_output=True)
-            # urandom
-            subprocess.run(["mknod", str(dev_dir / "urandom"), "c", "1", "9"], 
-                         capture_output=True)
+            for name, major, minor in DEVICE_NODES:
+                os.mknod(dev_dir / name, stat.S_IFCHR | 0o666, os.makedev(major, minor))
+                self._entries[dev_dir / name] = None
             
             print("Created device nodes")
-        except Exception as e:
+        except OSError as e:
             print(f"Warning: Could not create device nodes: {e}")
     
     def _create_config_files(self, initrd_root):
         """创建配置文件"""
         etc_dir = initrd_root / "etc"
-        etc_dir.mkdir(exist_ok=True)
+        self._make_dir(etc_dir)
         
         # 创建主机名文件
-        (etc_dir / "hostname").write_text("hnx-system\n")
+        self._write_file(etc_dir / "hostname", "hnx-system\n")
         
         # 创建 hosts 文件
         hosts_content = """127.0.0.1   localhost localhost.localdomain
 ::1         localhost localhost.localdomain
 """
-        (etc_dir / "hosts").write_text(hosts_content)
+        self._write_file(etc_dir / "hosts", hosts_content)
         
         # 创建 fstab
         fstab_content = """# <file system> <mount point>   <type>  <options>       <dump>  <pass>
@@ -306,49 +448,68 @@ proc            /proc           proc    defaults        0       0
 sysfs           /sys            sysfs   defaults        0       0
 devtmpfs        /dev            devtmpfs defaults       0       0
 """
-        (etc_dir / "fstab").write_text(fstab_content)
+        self._write_file(etc_dir / "fstab", fstab_content)
     
     def _pack_cpio(self, initrd_root, output_path, compress=True):
-        """打包为 cpio 归档"""
+        """打包为 cpio 归档（进程内生成 newc 格式，无需 find/cpio/gzip）"""
         print("Packing initrd...")
         
-        # 进入 initrd 目录并打包
         if compress:
-            cmd = f"cd {initrd_root} && find . -print | cpio -o -H newc | gzip -9 > {output_path}"
             format_desc = "newc format, gzip compressed"
         else:
-            cmd = f"cd {initrd_root} && find . -print | cpio -o -H newc > {output_path}"
             format_desc = "newc format, uncompressed"
         
+        # 使用暂存阶段记录的条目；按路径排序，保证父目录先于子项且输出可复现
+        entries = []
+        for path in sorted(self._entries):
+            rel = path.relative_to(initrd_root)
+            entries.append(("." if rel == Path(".") else f"./{rel}", path))
+        
         try:
-            result = subprocess.run(cmd, shell=True, check=True, capture_output=True)
+            if compress:
+                out_file = _gzip_open(output_path)
+            else:
+                out_file = open(output_path, "wb")
+            with out_file as out:
+                for ino, (name, path) in enumerate(entries, start=1):
+                    st = path.lstat()
+                    # 暂存时已在内存中的内容无需再读回
+                    data = self._entries[path]
+                    if data is None:
+                        if stat.S_ISREG(st.st_mode):
+                            data = path.read_bytes()
+                        elif stat.S_ISLNK(st.st_mode):
+                            data = os.readlink(path).encode()
+                        else:
+                            data = b""
+                    mode = None
+                    if path in self._executables:
+                        # 确保可执行权限（不修改暂存文件本身）
+                        mode = stat.S_IFREG | 0o755
+                    _write_newc_entry(out, name, ino, st, data, mode)
+                _write_newc_entry(out, NEWC_TRAILER, 0, None)
             size = output_path.stat().st_size
             print(f"  Packed initrd: {size:,} bytes ({format_desc})")
-        except subprocess.CalledProcessError as e:
+        except OSError as e:
             print(f"Error packing initrd: {e}")
-            print(f"stdout: {e.stdout.decode()}")
-            print(f"stderr: {e.stderr.decode()}")
             raise
     
     def create_boot_header(self, kernel_size, initrd_size):
         """创建引导头（可选）"""
         # 简单的引导头结构
         # 魔数 + 内核大小 + initrd偏移 + 命令行
-        header_format = "<8sIII256s"
         magic = b"HNXBOOT\x00"
         cmdline = b"console=ttyAMA0 root=/dev/ram0 init=/init quiet\x00"
         
         # 计算偏移量
-        header_size = struct.calcsize(header_format)
-        kernel_offset = header_size
+        kernel_offset = BOOT_HEADER.size
         initrd_offset = kernel_offset + kernel_size
         
-        header = struct.pack(header_format,
-                           magic,
-                           kernel_size,
-                           initrd_offset,
-                           len(cmdline),
-                           cmdline)
+        header = BOOT_HEADER.pack(magic,
+                                  kernel_size,
+                                  initrd_offset,
+                                  len(cmdline),
+                                  cmdline)
         
         return header
     
@@ -356,40 +517,49 @@ devtmpfs        /dev            devtmpfs defaults       0       0
         """创建原始镜像（内核 + initrd）"""
         print("Creating raw system image...")
         
-        with open(self.output_path, 'wb') as out_img:
-            # 读取内核
-            with open(self.kernel_path, 'rb') as kernel_file:
-                kernel_data = kernel_file.read()
-            
-            # 读取 initrd
-            with open(initrd_path, 'rb') as initrd_file:
-                initrd_data = initrd_file.read()
+        # 不缓冲写入：内核与 initrd 通过 sendfile 直接写入 fd，
+        # 避免 Python 层缓冲区与文件偏移不一致
+        with open(self.output_path, 'wb', buffering=0) as out_img, \
+             open(self.kernel_path, 'rb') as kernel_file, \
+             open(initrd_path, 'rb') as initrd_file:
+            kernel_size = os.fstat(kernel_file.fileno()).st_size
+            initrd_size = os.fstat(initrd_file.fileno()).st_size
             
             # 创建引导头
-            header = self.create_boot_header(len(kernel_data), len(initrd_data))
-            
-            # 写入镜像
-            out_img.write(header)
-            out_img.write(kernel_data)
+            header = self.create_boot_header(kernel_size, initrd_size)
             
             # 对齐到 4K 边界（可选）
-            current_pos = out_img.tell()
+            current_pos = len(header) + kernel_size
             align_to = 4096
             padding = (align_to - (current_pos % align_to)) % align_to
+            
+            # 最终文件大小已知，预先分配磁盘空间以减少 extent 分配
+            final_size = current_pos + padding + initrd_size
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(out_img.fileno(), 0, final_size)
+                except OSError:
+                    # 文件系统不支持预分配时按普通写入处理
+                    pass
+            
+            # 写入镜像
+            out_img.write(header)
+            _copy_stream(kernel_file, out_img, kernel_size)
+            
             if padding > 0:
                 out_img.write(b'\x00' * padding)
                 print(f"  Added {padding} bytes padding after kernel")
             
-            out_img.write(initrd_data)
+            _copy_stream(initrd_file, out_img, initrd_size)
             
-            # 最终文件大小
-            final_size = out_img.tell()
-            print(f"  Kernel size: {len(kernel_data):,} bytes")
-            print(f"  Initrd size: {len(initrd_data):,} bytes")
+            print(f"  Kernel size: {kernel_size:,} bytes")
+            print(f"  Initrd size: {initrd_size:,} bytes")
             print(f"  Total size: {final_size:,} bytes ({final_size/1024/1024:.2f} MB)")
     
     def create_qcow2_image(self, raw_image_path):
         """转换为 QCOW2 格式（可选）"""
+        import subprocess
+        
         qcow2_path = self.output_path.with_suffix('.qcow2')
         print(f"Creating QCOW2 image: {qcow2_path}")
         
@@ -409,6 +579,56 @@ devtmpfs        /dev            devtmpfs defaults       0       0
             print(f"Warning: Failed to create QCOW2 image: {e}")
             return None
     
+    def _manifest_path(self):
+        """构建清单路径（与输出镜像同目录）"""
+        return self.output_path.with_name(self.output_path.name + ".manifest")
+    
+    def _compute_manifest(self, create_qcow2):
+        """计算所有构建输入的内容摘要，用于判断镜像是否需要重建"""
+        # init/核心服务的候选路径与所有可执行文件的并集
+        candidates = set()
+        for name in ["init", *CORE_SERVICES]:
+            for base in [self.space_dir / "release", self.space_dir / "debug", self.space_dir]:
+                candidates.add(base / name)
+        candidates.update(Path(entry.path) for entry in _iter_executables(self.space_dir))
+        
+        files = {}
+        for path in sorted(candidates):
+            if _is_regular_file(path):
+                files[str(path.relative_to(self.space_dir))] = _file_digest(path)
+        
+        return {
+            "script": _file_digest(__file__),
+            "kernel": _file_digest(self.kernel_path),
+            "files": files,
+            "arch": self.arch,
+            "board": self.board,
+            "simple_initrd": self.simple_initrd,
+            "no_compress": self.no_compress,
+            "qcow2": create_qcow2,
+        }
+    
+    def _is_up_to_date(self, manifest, create_qcow2):
+        """输入未变化且所有输出都存在时返回 True"""
+        outputs = [self.output_path]
+        if self.no_compress:
+            outputs.append(Path("initrd.cpio"))
+        if create_qcow2:
+            outputs.append(self.output_path.with_suffix('.qcow2'))
+        if not all(path.exists() for path in outputs):
+            return False
+        
+        try:
+            recorded = json.loads(self._manifest_path().read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        
+        # initrd.cpio 位于当前目录，可能已被其他镜像目标（如 simple-image）覆盖
+        initrd_digest = recorded.pop("initrd", None)
+        if recorded != manifest:
+            return False
+        return not self.no_compress or initrd_digest == _file_digest(Path("initrd.cpio"))
+    
     def build(self, create_qcow2=False):
         """构建系统镜像"""
         print(f"Building HNX system image:")
@@ -422,23 +642,41 @@ devtmpfs        /dev            devtmpfs defaults       0       0
         start_time = time.time()
         
         try:
-            # 创建 initrd
-            initrd_path = self.create_initrd()
+            # 输入未变化时跳过重建
+            manifest = self._compute_manifest(create_qcow2)
+            if self._is_up_to_date(manifest, create_qcow2):
+                print(f"✓ System image is up-to-date: {self.output_path}")
+                return True
+            
+            # 构建失败时不能留下与旧镜像匹配的清单
+            self._manifest_path().unlink(missing_ok=True)
             
-            # 复制 initrd.cpio 到 build/ 目录（供 run-qemu.py 使用）
-            if initrd_path.suffix == ".cpio":
-                build_initrd = "initrd.cpio"
-                # pwd
-                print(f"Copying initrd to {build_initrd} for QEMU...")
-                shutil.copy2(initrd_path, build_initrd)
+            import tempfile
+            with tempfile.TemporaryDirectory(prefix="hnx_image_") as temp_dir:
+                self.temp_dir = Path(temp_dir)
+                print(f"Using temporary directory: {self.temp_dir}")
+                
+                # 创建 initrd
+                # 未压缩的 initrd.cpio 直接写到 build/ 目录（供 run-qemu.py 使用），
+                # 镜像也从这里读取，省去临时文件和额外复制
+                final_initrd = Path("initrd.cpio") if self.no_compress else None
+                initrd_path = self.create_initrd(final_initrd)
+                
+                # 创建原始镜像
+                self.create_raw_image(initrd_path)
             
-            # 创建原始镜像
-            self.create_raw_image(initrd_path)
+            print(f"Cleaned up temporary directory: {self.temp_dir}")
+            self.temp_dir = None
             
             # 可选：创建 QCOW2 格式镜像
             if create_qcow2:
                 self.create_qcow2_image(self.output_path)
             
+            # 记录本次构建的输入摘要（以及写到当前目录的 initrd 摘要）
+            if self.no_compress:
+                manifest = dict(manifest, initrd=_file_digest(Path("initrd.cpio")))
+            self._manifest_path().write_text(json.dumps(manifest, indent=2, sort_keys=True))
+            
             elapsed = time.time() - start_time
             print(f"\n✓ System image created successfully in {elapsed:.2f} seconds")
             print(f"  Output: {self.output_path}")
@@ -10,13 +10,27 @@ import shutil
 from pathlib import Path
 from version import VersionManager  # 导入上面的VersionManager
 
+# 可选：使用 pygit2 在进程内完成 git 操作，未安装时回退到 git 命令行
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+# 发布包压缩器，按优先级排列：(程序名, 参数, 扩展名)
+RELEASE_COMPRESSORS = [
+    ("zstd", ["-T0", "-19", "--long", "-q", "-c"], ".tar.zst"),
+    ("pigz", ["-c", "-n"], ".tar.gz"),
+    ("gzip", ["-c", "-n"], ".tar.gz"),
+]
+
 class ReleaseManager:
     def __init__(self):
         self.project_root = Path(__file__).parent.parent
         self.version_manager = VersionManager(str(self.project_root))
+        self.repo = pygit2.Repository(str(self.project_root)) if pygit2 else None
         
-    def create_release(self, release_type: str):
-        """创建发布"""
+    def create_release(self, release_type: str, clean: bool = False):
+        """创建发布（clean 为 True 时先执行 make clean 完整重新构建）"""
         # 1. 确保工作目录干净
         self._check_git_status()
         
@@ -34,81 +48,140 @@ class ReleaseManager:
         self.version_manager.set_prerelease("")
         
         # 4. 构建发布版本
-        self._build_release()
+        self._build_release(clean)
         
-        # 5. 创建git标签
+        # 5. 开始下一个开发周期
         version = self.version_manager.get_version_string()
-        self._create_git_tag(f"v{version}")
-        
-        print(f"✅ Release {version} created successfully!")
-        
-        # 6. 开始下一个开发周期
         next_prerelease = "alpha.1"
         self.version_manager.set_prerelease(next_prerelease)
         self.version_manager.sync_all()
         
-        subprocess.run(["git", "commit", "-am", f"version: start next development cycle"], check=True)
+        # 6. 在当前 HEAD 上创建发布标签，并提交下一周期的版本修改
+        self._tag_and_commit(f"v{version}", f"version: start next development cycle")
+        
+        print(f"✅ Release {version} created successfully!")
     
     def _check_git_status(self):
         """检查git状态"""
-        result = subprocess.run(
-            ["git", "status", "--porcelain"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        if result.stdout.strip():
+        if self.repo is not None:
+            dirty = bool(self.repo.status())
+        else:
+            result = subprocess.run(
+                ["git", "status", "--porcelain=v2", "-z"],
+                capture_output=True,
+                check=True
+            )
+            dirty = bool(result.stdout.strip())
+        
+        if dirty:
             print("❌ Working directory is not clean. Commit or stash changes first.")
             sys.exit(1)
     
-    def _build_release(self):
+    def _tag_and_commit(self, tag: str, message: str):
+        """创建发布标签并提交所有已跟踪文件的修改（等价于 git tag -a && git commit -am）
+        
+        标签指向提交前的 HEAD；命令行回退时两步合并为一次 sh -c 调用。
+        """
+        if self.repo is None:
+            subprocess.run(
+                ["sh", "-c", 'git tag -a "$1" -m "Release $1" && git commit -am "$2"',
+                 "sh", tag, message],
+                check=True
+            )
+        else:
+            self._create_git_tag(tag)
+            self._commit_all(message)
+        print(f"🏷️  Git tag created: {tag}")
+    
+    def _commit_all(self, message: str):
+        """通过 pygit2 提交所有已跟踪文件的修改（等价于 git commit -am）"""
+        index = self.repo.index
+        for path, flags in self.repo.status().items():
+            if flags & pygit2.GIT_STATUS_WT_DELETED:
+                index.remove(path)
+            elif flags & (pygit2.GIT_STATUS_WT_MODIFIED | pygit2.GIT_STATUS_WT_TYPECHANGE):
+                index.add(path)
+        index.write()
+        
+        signature = self.repo.default_signature
+        self.repo.create_commit("HEAD", signature, signature, message,
+                                index.write_tree(), [self.repo.head.target])
+    
+    def _build_release(self, clean: bool = False):
         """构建发布包"""
         version = self.version_manager.get_version_string()
-        build_dir = self.project_root / "build" / f"release-{version}"
-        
-        # 创建构建目录
-        shutil.rmtree(build_dir, ignore_errors=True)
-        build_dir.mkdir(parents=True, exist_ok=True)
         
-        # 执行构建
-        subprocess.run(["make", "clean"], cwd=self.project_root, check=True)
-        subprocess.run(["make", "all"], cwd=self.project_root, check=True)
+        # 执行构建，默认依赖 make 的增量构建
+        if clean:
+            subprocess.run(["make", "clean"], cwd=self.project_root, check=True)
+        subprocess.run(["make", f"-j{os.cpu_count() or 1}", "all"], cwd=self.project_root, check=True)
         
-        # 复制构建产物
+        # 构建产物直接以发布包内的名称写入 tar 流，不再复制到中间目录
         artifacts = [
             ("bin/hnx-kernel.elf", f"hnx-kernel-{version}.elf"),
             ("bin/initrd.cpio.gz", f"hnx-initrd-{version}.cpio.gz"),
             ("bin/hnx-image.img", f"hnx-image-{version}.img"),
         ]
-        
-        for src, dst in artifacts:
-            src_path = self.project_root / src
-            if src_path.exists():
-                shutil.copy2(src_path, build_dir / dst)
+        members = [(self.project_root / src, f"hnx-{version}/{dst}") for src, dst in artifacts]
+        members = [(src_path, arcname) for src_path, arcname in members if src_path.exists()]
         
         # 创建发布包
-        import tarfile
-        tar_path = self.project_root / "releases" / f"hnx-{version}.tar.gz"
+        compressor, suffix = self._find_compressor()
+        tar_path = self.project_root / "releases" / f"hnx-{version}{suffix}"
         tar_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with tarfile.open(tar_path, "w:gz") as tar:
-            tar.add(build_dir, arcname=f"hnx-{version}")
+        self._write_tarball(tar_path, members, compressor)
         
         print(f"📦 Release package created: {tar_path}")
     
+    def _find_compressor(self):
+        """选择可用的外部压缩器，返回 (命令行, 发布包扩展名)；都不可用时命令行为 None"""
+        for program, args, suffix in RELEASE_COMPRESSORS:
+            path = shutil.which(program)
+            if path:
+                return [path, *args], suffix
+        return None, ".tar.gz"
+    
+    def _write_tarball(self, tar_path: Path, members, compressor=None):
+        """将 members 中的 (源文件, 包内路径) 打包并压缩
+        
+        tar 流通过管道交给外部压缩器（zstd/pigz 多核并行压缩），
+        compressor 为 None 时回退到 tarfile 内置的 gzip 压缩。
+        """
+        import tarfile
+        
+        def add_members(tar):
+            for src_path, arcname in members:
+                tar.add(src_path, arcname=arcname)
+        
+        if not compressor:
+            with tarfile.open(tar_path, "w:gz") as tar:
+                add_members(tar)
+            return
+        
+        with open(tar_path, "wb") as tar_file:
+            proc = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=tar_file)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                    add_members(tar)
+            finally:
+                proc.stdin.close()
+                returncode = proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, compressor[0])
+    
     def _create_git_tag(self, tag: str):
-        """创建git标签"""
-        subprocess.run(["git", "tag", "-a", tag, "-m", f"Release {tag}"], check=True)
-        print(f"🏷️  Git tag created: {tag}")
+        """通过 pygit2 在当前 HEAD 上创建附注标签"""
+        self.repo.create_tag(tag, self.repo.head.target, pygit2.GIT_OBJECT_COMMIT,
+                             self.repo.default_signature, f"Release {tag}")
 
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="HNX Release Manager")
     parser.add_argument("type", choices=["major", "minor", "patch"], help="Release type")
+    parser.add_argument("--clean", action="store_true", help="Run make clean before building")
     
     args = parser.parse_args()
     
     manager = ReleaseManager()
-    manager.create_release(args.type)
\ No newline at end of file
+    manager.create_release(args.type, clean=args.clean)
\ No newline at end of file
@@ -5,17 +5,123 @@ HNX QEMU 运行工具 - 使用 TOML 配置文件
 """
 
 import argparse
+import functools
 import subprocess
 import sys
 import os
 import time
-import threading
+import selectors
+import shlex
 from pathlib import Path
 import tempfile
 import atexit
-import json
 import tomllib
 
+# 优先使用 orjson 解析 JSON 配置，未安装时回退到标准库 json
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+# 输出转发时每次读取的块大小
+PUMP_CHUNK_SIZE = 65536
+
+def _write_all(fd, data):
+    """将数据完整写入文件描述符（处理部分写入）"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+def _load_tee():
+    """获取 Linux tee(2) 的调用封装（os 模块只提供 splice），不可用时返回 None"""
+    if sys.platform != "linux" or not hasattr(os, "splice"):
+        return None
+    
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc_tee = libc.tee
+    except (OSError, AttributeError):
+        return None
+    libc_tee.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    libc_tee.restype = ctypes.c_ssize_t
+    
+    def tee(fd_in, fd_out, count, flags=0):
+        result = libc_tee(fd_in, fd_out, count, flags)
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+    return tee
+
+def _forward_read(src_fd, targets):
+    """读取一块数据并写入所有目标，返回转发的字节数（0 表示 EOF）"""
+    data = os.read(src_fd, PUMP_CHUNK_SIZE)
+    for fd in targets:
+        _write_all(fd, data)
+    return len(data)
+
+def _forward_tee(tee, src_fd, targets, side_pipe):
+    """在内核中转发一块数据，返回转发的字节数（0 表示 EOF）
+    
+    tee 将源管道中的数据复制到中转管道（不消耗源数据），
+    随后 splice 把源数据移入日志文件、把中转数据移入终端，全程不经过用户态。
+    """
+    term_fd, log_fd = targets
+    side_r, side_w = side_pipe
+    count = tee(src_fd, side_w, PUMP_CHUNK_SIZE, os.SPLICE_F_NONBLOCK)
+    
+    remaining = count
+    while remaining:
+        remaining -= os.splice(src_fd, log_fd, remaining)
+    
+    remaining = count
+    while remaining:
+        try:
+            remaining -= os.splice(side_r, term_fd, remaining)
+        except OSError:
+            # 目标不支持 splice（如部分终端设备），改为普通读写
+            data = os.read(side_r, remaining)
+            _write_all(term_fd, data)
+            remaining -= len(data)
+    return count
+
+def _iter_existing(candidates):
+    """按顺序产出存在的候选路径，同一父目录只列举一次"""
+    listings = {}
+    for candidate in candidates:
+        parent = candidate.parent
+        if parent not in listings:
+            try:
+                listings[parent] = set(os.listdir(parent))
+            except OSError:
+                listings[parent] = set()
+        if candidate.name in listings[parent]:
+            yield candidate
+
+@functools.lru_cache(maxsize=32)
+def _load_config_cached(path_str, mtime_ns):
+    """按 (路径, mtime) 缓存解析后的 config.json，文件修改后自动失效"""
+    return _json_loads(Path(path_str).read_bytes())
+
+@functools.lru_cache(maxsize=32)
+def _find_config_dir_cached(build_dir, arch, board):
+    """查找包含 config.json 的配置目录，结果按参数缓存"""
+    candidates = [
+        build_dir / "config",
+        build_dir / f"config-{arch}-{board}",
+        Path(".") / "config",
+    ]
+    
+    # 先通过父目录列表排除不存在的候选目录，再检查其中的 config.json
+    for candidate in _iter_existing(candidates):
+        config_file = candidate / "config.json"
+        if config_file.exists():
+            return candidate
+    return None
+
 class QEMURunner:
     """QEMU 运行管理器 - 使用 TOML 配置"""
     
@@ -55,7 +161,6 @@ class QEMURunner:
         
         # QEMU 进程
         self.qemu_process = None
-        self.timeout_timer = None
         self.killed_by_timeout = False
         
         # 输出文件
@@ -85,34 +190,23 @@ class QEMURunner:
     
     def _find_config_dir(self):
         """自动查找配置目录"""
-        # 尝试几个可能的配置目录
-        candidates = [
-            self.build_dir / "config",
-            self.build_dir / f"config-{self.arch}-{self.board}",
-            Path(".") / "config",
-        ]
-        
-        for candidate in candidates:
-            config_file = candidate / "config.json"
-            if config_file.exists():
-                return candidate
-        
-        print(f"Warning: No configuration directory found for {self.arch}/{self.board}")
-        return None
+        config_dir = _find_config_dir_cached(self.build_dir, self.arch, self.board)
+        if config_dir is None:
+            print(f"Warning: No configuration directory found for {self.arch}/{self.board}")
+        return config_dir
     
     def _load_config(self):
-        """加载配置"""
+        """加载配置（解析结果在进程内共享，调用方不应修改）"""
         config_file = self.config_dir / "config.json"
-        if not config_file.exists():
+        try:
+            mtime_ns = config_file.stat().st_mtime_ns
+        except FileNotFoundError:
             return {}
         
-        with open(config_file, 'r') as f:
-            return json.load(f)
+        return _load_config_cached(str(config_file), mtime_ns)
     
     def _get_qemu_config(self):
         """获取 QEMU 配置"""
-        qemu_config = self.config.get("qemu", {})
-        
         # 默认值
         defaults = {
             "machine": "virt",
@@ -122,12 +216,8 @@ class QEMURunner:
             "kernel_args": ""
         }
         
-        # 合并配置
-        for key, value in defaults.items():
-            if key not in qemu_config:
-                qemu_config[key] = value
-        
-        return qemu_config
+        # 合并配置（生成新字典，不修改缓存中的配置）
+        return defaults | self.config.get("qemu", {})
     
     def cleanup(self):
         """清理资源"""
@@ -172,11 +262,7 @@ class QEMURunner:
             self.image_path.parent / "initrd.cpio",
             self.build_dir / "initrd.cpio",
         ]
-        initrd_path = None
-        for candidate in initrd_candidates:
-            if candidate.exists():
-                initrd_path = candidate
-                break
+        initrd_path = next(_iter_existing(initrd_candidates), None)
 
         if initrd_path:
             # 使用 -device loader 加载 initrd 到固定地址 0x42000000
@@ -240,6 +326,45 @@ class QEMURunner:
                 print("QEMU did not terminate gracefully, forcing kill...")
                 self.qemu_process.kill()
     
+    def _pump_output(self, streams, deadline=None):
+        """使用 selectors 单线程转发 QEMU 输出
+        
+        streams: {管道: (终端 fd, 日志 fd)}，管道读到 EOF 后注销，全部注销时返回 True；
+        到达 deadline（time.monotonic() 时间）时提前返回 False。
+        Linux 上通过 tee/splice 在内核中转发，其他平台按块读取后写入。
+        """
+        tee = _load_tee()
+        side_pipes = {}
+        with selectors.DefaultSelector() as selector:
+            for pipe, targets in streams.items():
+                os.set_blocking(pipe.fileno(), False)
+                selector.register(pipe, selectors.EVENT_READ, targets)
+                if tee:
+                    side_pipes[pipe.fileno()] = os.pipe()
+            
+            try:
+                while selector.get_map():
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            return False
+                    for key, _ in selector.select(timeout):
+                        try:
+                            if tee:
+                                count = _forward_tee(tee, key.fd, key.data, side_pipes[key.fd])
+                            else:
+                                count = _forward_read(key.fd, key.data)
+                        except BlockingIOError:
+                            continue
+                        if not count:
+                            selector.unregister(key.fileobj)
+            finally:
+                for side_r, side_w in side_pipes.values():
+                    os.close(side_r)
+                    os.close(side_w)
+        return True
+    
     def run(self):
         """运行 QEMU"""
         # 构建命令
@@ -247,12 +372,12 @@ class QEMURunner:
         
         print("\n" + "=" * 60)
         print("Starting QEMU with command:")
-        print("  " + " ".join(qemu_cmd))
+        print("  " + shlex.join(qemu_cmd))
         print("=" * 60 + "\n")
         
         # 打开输出文件
-        stdout_fd = open(self.stdout_file, "wb")
-        stderr_fd = open(self.stderr_file, "wb")
+        stdout_fd = open(self.stdout_file, "wb", buffering=0)
+        stderr_fd = open(self.stderr_file, "wb", buffering=0)
         
         try:
             # 启动 QEMU 进程
@@ -261,7 +386,7 @@ class QEMURunner:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 stdin=subprocess.PIPE,
-                bufsize=1,
+                bufsize=0,
                 universal_newlines=False
             )
             
@@ -269,44 +394,33 @@ class QEMURunner:
             print("Press Ctrl+C to stop QEMU")
             print("-" * 40)
             
-            # 设置超时定时器
+            # 超时由输出转发循环的 select 超时实现，不需要额外的定时器线程
+            deadline = None
             if self.timeout > 0:
-                self.timeout_timer = threading.Timer(self.timeout, self.timeout_handler)
-                self.timeout_timer.start()
-                print(f"Timeout timer set for {self.timeout} seconds")
-            
-            # 创建输出处理线程
-            def read_stdout():
-                for line in iter(self.qemu_process.stdout.readline, b''):
-                    sys.stdout.buffer.write(line)
-                    sys.stdout.flush()
-                    stdout_fd.write(line)
-                    stdout_fd.flush()
+                deadline = time.monotonic() + self.timeout
+                print(f"Timeout set for {self.timeout} seconds")
             
-            def read_stderr():
-                for line in iter(self.qemu_process.stderr.readline, b''):
-                    sys.stderr.buffer.write(line)
-                    sys.stderr.flush()
-                    stderr_fd.write(line)
-                    stderr_fd.flush()
-            
-            # 启动输出线程
-            stdout_thread = threading.Thread(target=read_stdout, daemon=True)
-            stderr_thread = threading.Thread(target=read_stderr, daemon=True)
-            stdout_thread.start()
-            stderr_thread.start()
+            # 在当前线程中转发输出，直到 QEMU 关闭两个管道或超时
+            sys.stdout.flush()
+            sys.stderr.flush()
+            streams = {
+                self.qemu_process.stdout: (sys.stdout.fileno(), stdout_fd.fileno()),
+                self.qemu_process.stderr: (sys.stderr.fileno(), stderr_fd.fileno()),
+            }
+            if not self._pump_output(streams, deadline):
+                self.timeout_handler()
+                # 转发 QEMU 退出前剩余的输出（子进程可能仍持有管道，限时 5 秒）
+                self._pump_output(streams, time.monotonic() + 5)
+            elif deadline is not None:
+                # QEMU 可能关闭了输出管道但仍在运行，等待同样受超时限制
+                try:
+                    self.qemu_process.wait(timeout=max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    self.timeout_handler()
             
             # 等待进程结束
             return_code = self.qemu_process.wait()
             
-            # 取消超时定时器
-            if self.timeout_timer:
-                self.timeout_timer.cancel()
-            
-            # 等待输出线程结束
-            stdout_thread.join(timeout=1)
-            stderr_thread.join(timeout=1)
-            
             # 关闭文件
             stdout_fd.close()
             stderr_fd.close()
@@ -354,10 +468,6 @@ class QEMURunner:
                 stdout_fd.close()
             if not stderr_fd.closed:
                 stderr_fd.close()
-            
-            # 取消定时器
-            if self.timeout_timer:
-                self.timeout_timer.cancel()
 def main():
     parser = argparse.ArgumentParser(
         description="HNX QEMU Runner - Using TOML configuration",
@@ -6,63 +6,63 @@ This script verifies that the kernel's internal ABI definitions are consistent
 with the public C header files.
 """
 
+import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Rust const definitions and C #defines, matched on bytes to skip UTF-8 decoding
+RUST_CONST_RE = re.compile(rb'pub const (\w+):\s*\w+\s*=\s*(0x[0-9a-fA-F]+|\d+);')
+C_DEFINE_RE = re.compile(rb'#define\s+(\w+)\s+(0x[0-9a-fA-F]+|\d+)')
+
+def _collect_constants(pattern, content, constants):
+    """Collect constants matched by a precompiled pattern into constants"""
+    for match in pattern.finditer(content):
+        name = match.group(1).decode()
+        value = match.group(2)
+        # Normalize to decimal; base 0 auto-detects the 0x prefix
+        try:
+            constants[name] = str(int(value, 0))
+        except ValueError:
+            # Base 0 rejects decimals with leading zeros (e.g. 0755); keep them verbatim
+            constants[name] = value.decode()
+
 def extract_constants_from_rust(filepath):
     """Extract constants from Rust ABI file"""
     constants = {}
-    with open(filepath, 'r') as f:
+    with open(filepath, 'rb') as f:
         content = f.read()
     
     # Match Rust const definitions
-    pattern = r'pub const (\w+):\s*\w+\s*=\s*(0x[0-9a-fA-F]+|\d+);'
-    for match in re.finditer(pattern, content):
-        name = match.group(1)
-        value = match.group(2)
-        # Convert to decimal if hex
-        if value.startswith('0x'):
-            constants[name] = str(int(value, 16))
-        else:
-            constants[name] = value
+    _collect_constants(RUST_CONST_RE, content, constants)
+    
+    return constants
+
+def _parse_header(path):
+    """Extract #define constants from a single C header"""
+    constants = {}
+    with open(path, 'rb') as f:
+        content = f.read()
     
+    # Match C #define statements
+    _collect_constants(C_DEFINE_RE, content, constants)
     return constants
 
 def extract_constants_from_c(filepath):
     """Extract constants from C header files"""
-    constants = {}
+    if not filepath.is_dir():
+        return _parse_header(filepath)
     
-    # Process all C header files in the ABI directory
-    if filepath.is_dir():
-        for header_file in filepath.glob("*.h"):
-            with open(header_file, 'r') as f:
-                content = f.read()
-            
-            # Match C #define statements
-            pattern = r'#define\s+(\w+)\s+(0x[0-9a-fA-F]+|\d+)'
-            for match in re.finditer(pattern, content):
-                name = match.group(1)
-                value = match.group(2)
-                # Convert to decimal if hex
-                if value.startswith('0x'):
-                    constants[name] = str(int(value, 16))
-                else:
-                    constants[name] = value
-    else:
-        with open(filepath, 'r') as f:
-            content = f.read()
-        
-        # Match C #define statements
-        pattern = r'#define\s+(\w+)\s+(0x[0-9a-fA-F]+|\d+)'
-        for match in re.finditer(pattern, content):
-            name = match.group(1)
-            value = match.group(2)
-            # Convert to decimal if hex
-            if value.startswith('0x'):
-                constants[name] = str(int(value, 16))
-            else:
-                constants[name] = value
+    # Process all C header files in the ABI directory in parallel
+    with os.scandir(filepath) as entries:
+        paths = [entry.path for entry in entries
+                 if entry.name.endswith('.h') and entry.is_file()]
+    
+    constants = {}
+    with ThreadPoolExecutor() as pool:
+        for header_constants in pool.map(_parse_header, paths):
+            constants.update(header_constants)
     
     return constants
 
@@ -77,18 +77,19 @@ def main():
     
     # Check consistency
     errors = []
-    all_names = set(kernel_consts.keys()) | set(include_consts.keys())
+    kernel_names, include_names = kernel_consts.keys(), include_consts.keys()
+    
+    for name in kernel_names & include_names:
+        if kernel_consts[name] != include_consts[name]:
+            errors.append(f"{name}: kernel={kernel_consts[name]}, include={include_consts[name]}")
+    
+    for name in kernel_names - include_names:
+        # Check if this is a special constant that doesn't need to be in headers
+        if not name.startswith(('ZX_', 'HNX_ABI_')):
+            errors.append(f"{name}: defined in kernel but not in include headers")
     
-    for name in all_names:
-        if name in kernel_consts and name in include_consts:
-            if kernel_consts[name] != include_consts[name]:
-                errors.append(f"{name}: kernel={kernel_consts[name]}, include={include_consts[name]}")
-        elif name in kernel_consts:
-            # Check if this is a special constant that doesn't need to be in headers
-            if not name.startswith(('ZX_', 'HNX_ABI_')):
-                errors.append(f"{name}: defined in kernel but not in include headers")
-        else:
-            errors.append(f"{name}: defined in include headers but not in kernel")
+    for name in include_names - kernel_names:
+        errors.append(f"{name}: defined in include headers but not in kernel")
     
     if errors:
         print("ABI inconsistency found:", file=sys.stderr)
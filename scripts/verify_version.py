@@ -3,51 +3,67 @@
 版本一致性检查脚本
 """
 
+import functools
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from version import VersionManager
 
+# Cargo.toml 中的 version = "..." 字段（按字节匹配，跳过 UTF-8 解码）
+_CARGO_VERSION_RE = re.compile(rb'version\s*=\s*"([^"]+)"')
+
+@functools.lru_cache(maxsize=None)
+def _get_manager():
+    """获取共享的 VersionManager 实例"""
+    return VersionManager()
+
+def _check_file(path, check):
+    """检查单个文件，返回问题描述；没有问题时返回 None"""
+    return check(path, path.read_bytes())
+
 def verify_version_consistency():
     """验证所有子项目的版本一致性"""
     print("🔍 Verifying version consistency...")
     
-    manager = VersionManager()
-    expected_version = manager.get_version_string()
-    expected_full = manager.get_version_string(include_build=True)
+    def check_cargo_version(path, content):
+        match = _CARGO_VERSION_RE.search(content)
+        if match and match.group(1) != expected_version_bytes:
+            found = match.group(1).decode(errors="replace")
+            return f"{path}: version mismatch ({found} != {expected_version})"
+        return None
     
-    issues = []
+    def check_full_version(path, content):
+        if expected_full_literal not in content:
+            return f"{path}: version mismatch"
+        return None
     
-    # 检查内核Cargo.toml
-    kernel_toml = Path("kernel/Cargo.toml")
-    if kernel_toml.exists():
-        content = kernel_toml.read_text()
-        match = re.search(r'version\s*=\s*"([^"]+)"', content)
-        if match and match.group(1) != expected_version:
-            issues.append(f"kernel/Cargo.toml: version mismatch ({match.group(1)} != {expected_version})")
-    
-    # 检查用户空间Cargo.toml
-    space_toml = Path("space/Cargo.toml")
-    if space_toml.exists():
-        content = space_toml.read_text()
-        match = re.search(r'version\s*=\s*"([^"]+)"', content)
-        if match and match.group(1) != expected_version:
-            issues.append(f"space/Cargo.toml: version mismatch ({match.group(1)} != {expected_version})")
+    checks = [
+        # 内核Cargo.toml
+        (Path("kernel/Cargo.toml"), check_cargo_version),
+        # 用户空间Cargo.toml
+        (Path("space/Cargo.toml"), check_cargo_version),
+        # 版本头文件
+        (Path("include/hnx/abi/version.h"), check_full_version),
+        # Rust版本文件
+        (Path("kernel/src/version.rs"), check_full_version),
+    ]
+    # 不存在的文件跳过检查；没有任何文件时无需加载版本信息
+    checks = [(path, check) for path, check in checks if path.exists()]
+    if not checks:
+        print("✅ All versions are consistent!")
+        return
     
-    # 检查版本头文件
-    version_h = Path("include/hnx/abi/version.h")
-    if version_h.exists():
-        content = version_h.read_text()
-        if f'"{expected_full}"' not in content:
-            issues.append("include/hnx/abi/version.h: version mismatch")
+    manager = _get_manager()
+    expected_version = manager.get_version_string()
+    expected_version_bytes = expected_version.encode()
+    expected_full_literal = f'"{manager.get_version_string(include_build=True)}"'.encode()
     
-    # 检查Rust版本文件
-    version_rs = Path("kernel/src/version.rs")
-    if version_rs.exists():
-        content = version_rs.read_text()
-        if f'"{expected_full}"' not in content:
-            issues.append("kernel/src/version.rs: version mismatch")
+    # 各文件互不依赖，并行读取检查
+    with ThreadPoolExecutor(max_workers=len(checks)) as pool:
+        results = pool.map(lambda item: _check_file(*item), checks)
+    issues = [issue for issue in results if issue is not None]
     
     if issues:
         print("❌ Version inconsistencies found:")
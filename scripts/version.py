@@ -6,89 +6,276 @@ HNX 统一版本管理脚本
 import os
 import sys
 import re
-import configparser
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Tuple
-import subprocess
-import argparse
+from typing import Dict, Optional
+
+# Cargo.toml 中行首的 version = "..." 字段（[package] / [workspace.package] 的版本）
+_TOML_VERSION_RE = re.compile(r'^version\s*=\s*"[^"]+"', re.MULTILINE)
+
+# VERSION 中支持的变量 ${VAR}
+_VAR_RE = re.compile(r'\$\{(BUILD_DATE|GIT_HASH)\}')
+
+# C 版本头文件模板（str.format 占位符）
+_HEADER_TMPL = """#ifndef _HNX_ABI_VERSION_H
+#define _HNX_ABI_VERSION_H
+
+#define HNX_ABI_VERSION_MAJOR {major}
+#define HNX_ABI_VERSION_MINOR {minor}
+#define HNX_ABI_VERSION_PATCH {patch}
+#define HNX_ABI_VERSION "{full_version}"
+
+// 检查兼容性的宏
+#define HNX_ABI_CHECK_VERSION(major, minor, patch) \\
+    ((major == HNX_ABI_VERSION_MAJOR) && \\
+     (minor <= HNX_ABI_VERSION_MINOR))
+
+#endif // _HNX_ABI_VERSION_H
+"""
+
+# Rust 版本文件模板（str.format 占位符）
+_RUST_TMPL = """//! 内核版本信息 - 自动生成，请勿手动修改
+
+/// 主版本号
+pub const MAJOR: u32 = {major};
+
+/// 次版本号
+pub const MINOR: u32 = {minor};
+
+/// 修订版本号
+pub const PATCH: u32 = {patch};
+
+/// 预发布标签
+pub const PRERELEASE: &str = "{prerelease}";
+
+/// 完整版本字符串
+pub const VERSION_STRING: &str = "{full_version}";
+
+/// 获取版本字符串
+#[no_mangle]
+pub extern "C" fn hnx_get_version() -> &'static str {{
+    VERSION_STRING
+}}
+
+/// 获取主版本号
+#[no_mangle]
+pub extern "C" fn hnx_get_version_major() -> u32 {{
+    MAJOR
+}}
+
+/// 获取次版本号
+#[no_mangle]
+pub extern "C" fn hnx_get_version_minor() -> u32 {{
+    MINOR
+}}
+
+/// 获取修订版本号
+#[no_mangle]
+pub extern "C" fn hnx_get_version_patch() -> u32 {{
+    PATCH
+}}
+"""
 
 class VersionManager:
+    # sync_all 生成的文件：(self.paths 中的键, 模板)
+    _GENERATED_FILES = [
+        ("header", _HEADER_TMPL),
+        ("rust", _RUST_TMPL),
+    ]
+    
     def __init__(self, project_root: str = None):
         self.project_root = project_root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.version_file = os.path.join(self.project_root, "VERSION")
-        self.config = configparser.ConfigParser(interpolation=None)
+        # sync_all 涉及的文件路径，只在构造时计算一次
+        root = Path(self.project_root)
+        self.paths = {
+            "kernel_toml": root / "kernel" / "Cargo.toml",
+            "space_toml": root / "space" / "Cargo.toml",
+            "header": root / "include" / "hnx" / "abi" / "version.h",
+            "rust": root / "kernel" / "src" / "version.rs",
+        }
+        # VERSION 文件内容：{节名: {键: 值}}
+        self.config = {}
+        # git 哈希与构建日期在一次运行中不变，首次获取后缓存
+        self._git_hash = None
+        self._build_date = None
+        # 已加载的版本信息，save_version 时更新
+        self._cached_version = None
         
+    def _read_head_commit(self) -> Optional[str]:
+        """直接读取 .git 得到 HEAD 指向的完整提交哈希，无法解析时返回 None"""
+        git_dir = Path(self.project_root) / ".git"
+        try:
+            head = (git_dir / "HEAD").read_text().strip()
+            if not head.startswith("ref: "):
+                return head  # 分离 HEAD
+            ref = head[len("ref: "):]
+            try:
+                return (git_dir / ref).read_text().strip()
+            except FileNotFoundError:
+                pass
+            # 引用已被打包到 packed-refs
+            with open(git_dir / "packed-refs", "r") as f:
+                for line in f:
+                    sha, _, name = line.rstrip("\n").partition(" ")
+                    if name == ref:
+                        return sha
+        except OSError:
+            pass
+        return None
+    
     def _get_git_hash(self) -> str:
-        """获取当前git提交哈希"""
+        """获取当前git提交哈希
+        
+        CI 提供的提交哈希优先；否则以 HEAD 指向的提交为键查询 .version_cache，
+        未命中时才调用 git 并更新缓存。
+        """
+        if self._git_hash is not None:
+            return self._git_hash
+        
+        ci_sha = os.environ.get("GITHUB_SHA") or os.environ.get("CI_COMMIT_SHA")
+        if ci_sha:
+            self._git_hash = ci_sha[:7]
+            return self._git_hash
+        
+        cache_file = Path(self.project_root) / ".version_cache"
+        key = self._read_head_commit()
+        if key:
+            try:
+                cached_key, cached_hash = cache_file.read_text().split()
+                if cached_key == key:
+                    self._git_hash = cached_hash
+                    return self._git_hash
+            except (OSError, ValueError):
+                pass
+        
+        import subprocess
+        
         try:
+            # 只读操作：不获取可选的 index 锁，也不触发 fsmonitor
             result = subprocess.run(
-                ["git", "rev-parse", "--short", "HEAD"],
+                ["git", "--no-optional-locks", "-c", "core.fsmonitor=false",
+                 "show", "-s", "--format=%h", "HEAD"],
                 cwd=self.project_root,
-                capture_output=True,
-                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=2,
                 check=True
             )
-            return result.stdout.strip()
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return "unknown"
+            self._git_hash = result.stdout.decode("ascii", "replace").strip()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+            self._git_hash = "unknown"
+            return self._git_hash
+        
+        if key:
+            try:
+                cache_file.write_text(f"{key} {self._git_hash}\n")
+            except OSError:
+                pass
+        return self._git_hash
     
     def _get_build_date(self) -> str:
         """获取构建日期"""
-        return datetime.utcnow().strftime("%Y%m%d")
+        if self._build_date is None:
+            self._build_date = time.strftime("%Y%m%d", time.gmtime())
+        return self._build_date
     
     def _expand_variables(self, text: str) -> str:
         """展开变量 ${VAR}"""
-        if "${BUILD_DATE}" in text:
-            text = text.replace("${BUILD_DATE}", self._get_build_date())
-        if "${GIT_HASH}" in text:
-            text = text.replace("${GIT_HASH}", self._get_git_hash())
-        return text
+        if "${" not in text:
+            return text
+        # 变量值按需获取（均已缓存），一次扫描完成替换
+        getters = {"BUILD_DATE": self._get_build_date, "GIT_HASH": self._get_git_hash}
+        return _VAR_RE.sub(lambda match: getters[match.group(1)](), text)
+    
+    def _parse_version_file(self) -> Dict[str, Dict[str, str]]:
+        """解析 VERSION 文件（简单 INI：[节]、key = value、# 与 ; 注释）"""
+        sections = {}
+        section = None
+        with open(self.version_file, "r") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith(("#", ";")):
+                    continue
+                if line.startswith("[") and line.endswith("]"):
+                    section = sections.setdefault(line[1:-1].strip(), {})
+                    continue
+                key, sep, value = line.partition("=")
+                if section is None or not sep:
+                    raise ValueError(f"{self.version_file}:{lineno}: invalid line: {line}")
+                section[key.strip().lower()] = value.strip()
+        return sections
+    
+    def _write_version_file(self):
+        """将 self.config 写回 VERSION 文件"""
+        lines = []
+        for section, values in self.config.items():
+            lines.append(f"[{section}]")
+            lines.extend(f"{key} = {value}" for key, value in values.items())
+            lines.append("")
+        
+        with open(self.version_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
     
     def load_version(self) -> Dict:
         """加载版本信息"""
+        if self._cached_version is not None:
+            return dict(self._cached_version)
+        
         if not os.path.exists(self.version_file):
             raise FileNotFoundError(f"Version file not found: {self.version_file}")
         
-        self.config.read(self.version_file)
+        self.config = self._parse_version_file()
         
-        # 展开变量
-        for section in self.config.sections():
-            for key in self.config[section]:
-                value = self.config[section][key]
-                self.config[section][key] = self._expand_variables(value)
+        # 只有 metadata 中的字段会使用变量，直接展开这两个字段
+        metadata = self.config["metadata"]
         
-        return {
+        self._cached_version = {
             "major": int(self.config["version"]["major"]),
             "minor": int(self.config["version"]["minor"]),
             "patch": int(self.config["version"]["patch"]),
             "prerelease": self.config["version"].get("prerelease", ""),
-            "build_date": self.config["metadata"]["build_date"],
-            "git_hash": self.config["metadata"]["git_hash"]
+            "build_date": self._expand_variables(metadata["build_date"]),
+            "git_hash": self._expand_variables(metadata["git_hash"])
         }
+        return dict(self._cached_version)
     
     def save_version(self, version: Dict):
         """保存版本信息"""
-        # 更新config
-        self.config["version"] = {
-            "major": str(version["major"]),
-            "minor": str(version["minor"]),
-            "patch": str(version["patch"]),
-            "prerelease": version.get("prerelease", "")
-        }
+        # 原地更新已加载的各节（init 时节尚不存在则新建）
+        self.config.setdefault("version", {}).update(
+            major=str(version["major"]),
+            minor=str(version["minor"]),
+            patch=str(version["patch"]),
+            prerelease=version.get("prerelease", "")
+        )
         
-        self.config["metadata"] = {
-            "build_date": "${BUILD_DATE}",
-            "git_hash": "${GIT_HASH}"
-        }
+        self.config.setdefault("metadata", {}).update(
+            build_date="${BUILD_DATE}",
+            git_hash="${GIT_HASH}"
+        )
         
         # 写入文件
-        with open(self.version_file, "w") as f:
-            self.config.write(f)
+        self._write_version_file()
+        
+        # 与重新读取文件并展开变量的结果一致
+        self._cached_version = {
+            "major": int(version["major"]),
+            "minor": int(version["minor"]),
+            "patch": int(version["patch"]),
+            "prerelease": version.get("prerelease", ""),
+            "build_date": self._get_build_date(),
+            "git_hash": self._get_git_hash()
+        }
     
     def get_version_string(self, include_build: bool = False) -> str:
         """获取版本字符串"""
-        version = self.load_version()
+        return self._format_version(self.load_version(), include_build)
+    
+    @staticmethod
+    def _format_version(version: Dict, include_build: bool = False) -> str:
+        """将版本信息格式化为版本字符串（仅依赖传入的字典）"""
         version_str = f"{version['major']}.{version['minor']}.{version['patch']}"
         
         if version["prerelease"]:
@@ -120,7 +307,7 @@ class VersionManager:
             raise ValueError(f"Invalid version part: {part}")
         
         self.save_version(version)
-        print(f"Version bumped to {self.get_version_string()}")
+        print(f"Version bumped to {self._format_version(version)}")
     
     def set_prerelease(self, prerelease: str):
         """设置预发布标签"""
@@ -132,127 +319,98 @@ class VersionManager:
     def sync_all(self):
         """同步版本到所有子项目"""
         version = self.load_version()
-        version_str = self.get_version_string()
-        full_version = self.get_version_string(include_build=True)
+        version_str = self._format_version(version)
+        full_version = self._format_version(version, include_build=True)
         
         print(f"Syncing version {version_str} to all subprojects...")
         
-        # 1. 更新内核 Cargo.toml
-        kernel_toml = os.path.join(self.project_root, "kernel", "Cargo.toml")
-        self._update_toml_version(kernel_toml, version_str)
-        
-        # 2. 更新用户空间 Cargo.toml
-        space_toml = os.path.join(self.project_root, "space", "Cargo.toml")
-        self._update_toml_version(space_toml, version_str)
+        # 生成文件所在目录统一创建一次（Cargo.toml 缺失时只给出警告，不创建目录）
+        for directory in {self.paths[name].parent for name, _ in self._GENERATED_FILES}:
+            os.makedirs(directory, exist_ok=True)
         
-        # 3. 生成版本头文件
-        self._generate_version_header(full_version, version)
+        # 四个文件互不相关，并行更新（git 哈希等已在 load_version 中缓存）
+        context = {**version, "full_version": full_version}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                # 1. 更新内核 Cargo.toml / 2. 更新用户空间 Cargo.toml
+                (self.paths[name], pool.submit(self._update_toml_version, self.paths[name], version_str))
+                for name in ("kernel_toml", "space_toml")
+            ]
+            # 3. 生成版本头文件与 Rust 版本文件
+            futures += [
+                (self.paths[name], pool.submit(self._emit_generated_file, self.paths[name], template, context))
+                for name, template in self._GENERATED_FILES
+            ]
+        results = [(path, future.result()) for path, future in futures]
         
-        # 4. 生成Rust版本文件
-        self._generate_rust_version_file(full_version, version)
+        # 汇总输出，None 表示已跳过（原因已在警告中给出）
+        for path, changed in results:
+            if changed is not None:
+                status = "Updated" if changed else "Unchanged"
+                print(f"  {status} {path.relative_to(self.project_root)}")
         
         print("Sync completed!")
     
-    def _update_toml_version(self, toml_path: str, version: str):
-        """更新Cargo.toml版本"""
-        if not os.path.exists(toml_path):
-            print(f"Warning: {toml_path} not found")
-            return
-        
-        with open(toml_path, "r") as f:
-            content = f.read()
-        
-        # 更新版本号
-        pattern = r'^version\s*=\s*"[^"]+"'
-        replacement = f'version = "{version}"'
-        content = re.sub(pattern, replacement, content, flags=re.MULTILINE)
+    def _write_if_changed(self, path: Path, content: str) -> bool:
+        """内容与现有文件不同时才写入，返回是否写入"""
+        try:
+            with open(path, "r") as f:
+                if f.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
         
-        with open(toml_path, "w") as f:
+        with open(path, "w") as f:
             f.write(content)
-        
-        print(f"  Updated {os.path.relpath(toml_path, self.project_root)}")
+        return True
     
-    def _generate_version_header(self, full_version: str, version: Dict):
-        """生成C版本头文件"""
-        header_path = os.path.join(self.project_root, "include", "hnx", "abi", "version.h")
-        os.makedirs(os.path.dirname(header_path), exist_ok=True)
-        
-        header_content = f"""#ifndef _HNX_ABI_VERSION_H
-#define _HNX_ABI_VERSION_H
-
-#define HNX_ABI_VERSION_MAJOR {version['major']}
-#define HNX_ABI_VERSION_MINOR {version['minor']}
-#define HNX_ABI_VERSION_PATCH {version['patch']}
-#define HNX_ABI_VERSION "{full_version}"
-
-// 检查兼容性的宏
-#define HNX_ABI_CHECK_VERSION(major, minor, patch) \\
-    ((major == HNX_ABI_VERSION_MAJOR) && \\
-     (minor <= HNX_ABI_VERSION_MINOR))
-
-#endif // _HNX_ABI_VERSION_H
-"""
+    def _update_toml_version(self, toml_path: Path, version: str) -> Optional[bool]:
+        """更新Cargo.toml版本，返回是否修改；文件或版本字段不存在时返回 None
         
-        with open(header_path, "w") as f:
-            f.write(header_content)
+        逐行扫描到第一个行首的 version 字段（每个 Cargo.toml 只有一个）：
+        已是目标值时直接返回，否则写入临时文件后通过 os.replace 原子替换。
+        """
+        if not toml_path.exists():
+            print(f"Warning: {toml_path} not found")
+            return None
         
-        print(f"  Generated {os.path.relpath(header_path, self.project_root)}")
+        expected = f'version = "{version}"'
+        with open(toml_path, "r", newline="") as src:
+            head = []
+            for line in src:
+                match = _TOML_VERSION_RE.match(line)
+                if match:
+                    break
+                head.append(line)
+            else:
+                print(f"Warning: no version field in {toml_path.relative_to(self.project_root)}")
+                return None
+            
+            if match.group() == expected:
+                return False
+            
+            tmp_path = toml_path.with_name(toml_path.name + ".tmp")
+            try:
+                with open(tmp_path, "w", newline="") as dst:
+                    dst.writelines(head)
+                    dst.write(expected + line[match.end():])
+                    # 其余内容按块复制
+                    while chunk := src.read(65536):
+                        dst.write(chunk)
+                os.chmod(tmp_path, os.stat(toml_path).st_mode & 0o7777)
+                os.replace(tmp_path, toml_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        return True
     
-    def _generate_rust_version_file(self, full_version: str, version: Dict):
-        """生成Rust版本文件"""
-        version_rs = os.path.join(self.project_root, "kernel", "src", "version.rs")
-        os.makedirs(os.path.dirname(version_rs), exist_ok=True)
-        
-        prerelease_str = f'"{version["prerelease"]}"' if version["prerelease"] else '""'
-        
-        rust_content = f"""//! 内核版本信息 - 自动生成，请勿手动修改
-
-/// 主版本号
-pub const MAJOR: u32 = {version['major']};
-
-/// 次版本号
-pub const MINOR: u32 = {version['minor']};
-
-/// 修订版本号
-pub const PATCH: u32 = {version['patch']};
-
-/// 预发布标签
-pub const PRERELEASE: &str = {prerelease_str};
-
-/// 完整版本字符串
-pub const VERSION_STRING: &str = "{full_version}";
-
-/// 获取版本字符串
-#[no_mangle]
-pub extern "C" fn hnx_get_version() -> &'static str {{
-    VERSION_STRING
-}}
-
-/// 获取主版本号
-#[no_mangle]
-pub extern "C" fn hnx_get_version_major() -> u32 {{
-    MAJOR
-}}
-
-/// 获取次版本号
-#[no_mangle]
-pub extern "C" fn hnx_get_version_minor() -> u32 {{
-    MINOR
-}}
-
-/// 获取修订版本号
-#[no_mangle]
-pub extern "C" fn hnx_get_version_patch() -> u32 {{
-    PATCH
-}}
-"""
-        
-        with open(version_rs, "w") as f:
-            f.write(rust_content)
-        
-        print(f"  Generated {os.path.relpath(version_rs, self.project_root)}")
+    def _emit_generated_file(self, path: Path, template: str, context: Dict) -> bool:
+        """用模板生成版本文件，返回是否修改（目录已由 sync_all 创建）"""
+        return self._write_if_changed(path, template.format_map(context))
 
 def main():
+    import argparse
+    
     parser = argparse.ArgumentParser(description="HNX Version Manager")
     subparsers = parser.add_subparsers(dest="command", help="Commands")
     
@@ -280,6 +438,11 @@ def main():
     init_parser.add_argument("--prerelease", default="alpha.1", help="Prerelease tag")
     
     args = parser.parse_args()
+    # 未指定命令时只打印帮助，无需创建 VersionManager
+    if not args.command:
+        parser.print_help()
+        return
+    
     manager = VersionManager()
     
     if args.command == "read":
@@ -307,9 +470,6 @@ def main():
         }
         manager.save_version(version)
         print(f"Initialized version to {manager.get_version_string()}")
-    
-    else:
-        parser.print_help()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file